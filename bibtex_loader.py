@@ -1,11 +1,6 @@
-
+#!/usr/bin/env python3
 # MIT License
-
 # Copyright (c) 2026 Rachid, Youven ZEGHLACHE
-#!/usr/bin/env python3
-
-
-#!/usr/bin/env python3
 """
 Inkscape extension to load reference files and add formatted references to drawings.
 Supports BibTeX, RIS, and JSON formats.
@@ -13,15 +8,148 @@ Supports both Inkscape native text and LaTeX rendering.
 """
 
 import inkex
-from inkex import TextElement, Rectangle, Group, Transform, Tspan
+from inkex import Rectangle, Group, Transform
+from lxml import etree
 import re
+import sys
+import bisect
 from pathlib import Path
-import json
-import tempfile
-import subprocess
-import shutil
+from textwrap import TextWrapper
 import os
-from lxml import etree
+import mmap
+from typing import NamedTuple
+
+try:
+    # Optional compiled BibTeX parser (Rust, PyO3 bindings); the regex parser
+    # below is used when it is not installed.
+    import bibtex_parser
+except ImportError:
+    bibtex_parser = None
+else:
+    # Another module with this generic name is not the parser
+    if not callable(getattr(bibtex_parser, 'parse_str', None)):
+        bibtex_parser = None
+
+try:
+    # Optional compiled helpers (Cython, bibtex_wrap.pyx) for line wrapping and
+    # LaTeX escaping; TextWrapper and the regex escape are used when it has
+    # not been built.
+    import bibtex_wrap
+except ImportError:
+    bibtex_wrap = None
+
+
+# Precompiled patterns used by the reference parsers (entries are matched on
+# the raw bytes of a memory-mapped .bib file)
+_BIB_ENTRY_RE = re.compile(rb'@(\w+)\s*\{\s*([^,]+)\s*,\s*((?:[^{}]|\{[^{}]*\})*)\}', re.DOTALL | re.IGNORECASE)
+_BIB_FIELD_RE = re.compile(r'(\w+)\s*=\s*[{"]((?:[^{}"]|\{[^{}]*\})*)[}"]', re.DOTALL)
+_AUTHOR_SPLIT_RE = re.compile(r'\s*,\s*(?:and\s+)?|\s+and\s+')
+
+# Translation table deleting TeX grouping braces from field values
+_BRACE_DEL = str.maketrans('', '', '{}')
+
+# LaTeX special characters and their escapes, applied in a single regex pass
+# so characters inserted by one replacement are never escaped again
+_LATEX_SPECIAL_RE = re.compile(r'[\\&%$#_{}~^]')
+_LATEX_MAP = {
+    '\\': r'\textbackslash{}',
+    '&': r'\&',
+    '%': r'\%',
+    '$': r'\$',
+    '#': r'\#',
+    '_': r'\_',
+    '{': r'\{',
+    '}': r'\}',
+    '~': r'\textasciitilde{}',
+    '^': r'\textasciicircum{}'
+}
+
+# Upper pixel bounds of each LaTeX size command; sizes above the last bound
+# map to the trailing \huge
+_SIZE_BREAKS = (8, 10, 11, 12, 14, 17, 20, 25)
+_SIZE_CMDS = (
+    r'\tiny', r'\scriptsize', r'\footnotesize', r'\small', r'\normalsize',
+    r'\large', r'\Large', r'\LARGE', r'\huge'
+)
+
+# Namespace-qualified SVG tags for elements created or matched directly
+# through lxml
+_SVG_NS = 'http://www.w3.org/2000/svg'
+_TEXT_TAG = f'{{{_SVG_NS}}}text'
+_METADATA_TAG = f'{{{_SVG_NS}}}metadata'
+_DEFS_TAG = f'{{{_SVG_NS}}}defs'
+
+# Serialized style of the optional background box
+_BOX_STYLE = 'fill:#ffffff;fill-opacity:1;stroke:#cccccc;stroke-width:1'
+
+
+class Entry(NamedTuple):
+    """A parsed reference: entry type, citation key and field values."""
+    type: str
+    key: str
+    fields: dict
+
+
+def _assign(fields, name, value):
+    """Store a tag value as-is."""
+    fields[name] = value
+
+
+def _append_author(fields, name, value):
+    """Append an author to the ' and '-separated author list."""
+    if name in fields:
+        fields[name] += ' and ' + value
+    else:
+        fields[name] = value
+
+
+def _assign_year(fields, name, value):
+    """Keep only the year of a date value."""
+    fields[name] = value[:4]
+
+
+def _assign_ris_year(fields, name, value):
+    """Keep only the year of a RIS 'YYYY/MM/DD' date."""
+    fields[name] = value.split('/')[0]
+
+
+def _append_end_page(fields, name, value):
+    """Turn a start page into a 'start-end' range."""
+    if name in fields:
+        fields[name] += '-' + value
+
+
+# RIS tag -> (field name, setter)
+_RIS_TAGS = {
+    'AU': ('author', _append_author),
+    'TI': ('title', _assign),
+    'PY': ('year', _assign_ris_year),
+    'JO': ('journal', _assign),
+    'JF': ('journal', _assign),
+    'T2': ('journal', _assign),
+    'VL': ('volume', _assign),
+    'IS': ('number', _assign),
+    'SP': ('pages', _assign),
+    'EP': ('pages', _append_end_page),
+    'PB': ('publisher', _assign),
+}
+
+# EndNote tag -> (field name, setter)
+_ENDNOTE_TAGS = {
+    'A': ('author', _append_author),
+    'T': ('title', _assign),
+    'D': ('year', _assign_year),
+    'J': ('journal', _assign),
+    'V': ('volume', _assign),
+    'N': ('number', _assign),
+    'P': ('pages', _assign),
+    'I': ('publisher', _assign),
+}
+
+# Marker tables for the 'symbols' and 'roman' numbering styles
+_SYMBOLS = ('*', '†', '‡', '§', '¶', '‖', '**', '††', '‡‡')
+_ROMAN = ('i', 'ii', 'iii', 'iv', 'v', 'vi', 'vii', 'viii', 'ix', 'x',
+          'xi', 'xii', 'xiii', 'xiv', 'xv', 'xvi', 'xvii', 'xviii', 'xix', 'xx')
 
 
 class BibTeXLoader(inkex.EffectExtension):
@@ -57,14 +185,25 @@ class BibTeXLoader(inkex.EffectExtension):
     
     def effect(self):
         """Main effect function."""
+        opts = self.options
+        
+        # Style names are compared for every entry; intern them so those
+        # comparisons can short-circuit on identity
+        opts.format = sys.intern(opts.format)
+        opts.numbering_style = sys.intern(opts.numbering_style)
+        opts.sort_order = sys.intern(opts.sort_order)
+        
+        style = opts.format
+        sort_order = opts.sort_order
+        
         # Check if we should update existing references
-        if self.options.update_existing:
+        if opts.update_existing:
             existing_group = self.find_existing_references()
-            if existing_group:
+            if existing_group is not None:
                 # Remove the existing group
                 existing_group.getparent().remove(existing_group)
         
-        bibfile = self.options.bibfile
+        bibfile = opts.bibfile
         
         if not bibfile or not Path(bibfile).exists():
             inkex.errormsg(f"Please provide a valid reference file path.\nReceived: {bibfile}")
@@ -74,26 +213,31 @@ class BibTeXLoader(inkex.EffectExtension):
         file_path = Path(bibfile)
         entries = self.parse_reference_file(file_path)
         
-        if not entries:
+        # Sort entries (appearance order streams straight into formatting)
+        entries = self.sort_entries(entries, sort_order)
+        
+        # Format references
+        formatted_refs = self.format_with_python(entries, style)
+        
+        if not formatted_refs:
             inkex.errormsg("No valid reference entries found in the file.")
             return
         
-        # Sort entries
-        entries = self.sort_entries(entries)
-        
-        # Format references
-        formatted_refs = self.format_with_python(entries)
+        # Numbering markers are built once and shared by both backends, since
+        # the LaTeX backend falls back to the Inkscape one on failure
+        numbering_style = opts.numbering_style
+        markers = [self.get_numbering_marker(i, numbering_style) for i in range(1, len(formatted_refs) + 1)]
         
         # Choose backend
-        if self.options.backend == "latex":
+        if opts.backend == "latex":
             try:
-                self.add_references_latex(formatted_refs, entries)
+                self.add_references_latex(formatted_refs, markers)
             except Exception as e:
                 inkex.errormsg(f"LaTeX rendering failed: {str(e)}")
                 inkex.utils.debug("Falling back to Inkscape backend")
-                self.add_references_to_document(formatted_refs)
+                self.add_references_to_document(formatted_refs, markers)
         else:
-            self.add_references_to_document(formatted_refs)
+            self.add_references_to_document(formatted_refs, markers)
     
     def get_position(self):
         """Calculate position based on position mode."""
@@ -121,15 +265,13 @@ class BibTeXLoader(inkex.EffectExtension):
     
     def find_existing_references(self):
         """Find existing references group in the document."""
-        # Look for groups with id starting with 'references'
-        for elem in self.svg.xpath('//svg:g[@id]'):
-            elem_id = elem.get('id', '')
-            if elem_id.startswith('references'):
-                return elem
-        return None
+        # Look for the first group with id starting with 'references'; the id
+        # carries a generated suffix, so filter inside the XPath query itself
+        matches = self.svg.xpath('(//svg:g[starts-with(@id, "references")])[1]')
+        return matches[0] if matches else None
     
     def parse_reference_file(self, filepath):
-        """Parse reference file based on extension."""
+        """Parse reference file based on extension, yielding entries lazily."""
         extension = filepath.suffix.lower()
         
         if extension == '.bib':
@@ -146,63 +288,64 @@ class BibTeXLoader(inkex.EffectExtension):
     
     def parse_bibtex(self, filepath):
         """Parse a BibTeX file and extract entries."""
-        entries = []
-        
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            # Regex to match BibTeX entries
-            pattern = r'@(\w+)\s*\{\s*([^,]+)\s*,\s*((?:[^{}]|\{[^{}]*\})*)\}'
-            matches = re.finditer(pattern, content, re.DOTALL | re.IGNORECASE)
-            
-            for match in matches:
-                entry_type = match.group(1)
-                cite_key = match.group(2).strip()
-                fields_str = match.group(3)
+            with open(filepath, 'rb') as f:
+                # The compiled parser runs to completion before anything is
+                # yielded; if it rejects the file, the regex parser below is
+                # used instead
+                if bibtex_parser is not None:
+                    try:
+                        entries = list(self.parse_bibtex_native(f.read()))
+                    except Exception:
+                        entries = None
+                    if entries is not None:
+                        yield from entries
+                        return
                 
-                # Parse fields
-                fields = {}
-                field_pattern = r'(\w+)\s*=\s*[{"]((?:[^{}"]|\{[^{}]*\})*)[}"]'
-                for field_match in re.finditer(field_pattern, fields_str, re.DOTALL):
-                    field_name = field_match.group(1).lower()
-                    field_value = field_match.group(2).strip()
-                    # Remove extra braces
-                    field_value = re.sub(r'\{([^{}]*)\}', r'\1', field_value)
-                    fields[field_name] = field_value
+                # mmap cannot map an empty file
+                if os.fstat(f.fileno()).st_size == 0:
+                    return
                 
-                entries.append({
-                    'type': entry_type.lower(),
-                    'key': cite_key,
-                    'fields': fields
-                })
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                    for match in _BIB_ENTRY_RE.finditer(buf):
+                        entry_type = match.group(1).decode('utf-8')
+                        cite_key = match.group(2).decode('utf-8').strip()
+                        fields_str = match.group(3).decode('utf-8')
+                        
+                        # Parse fields
+                        fields = {}
+                        for field_match in _BIB_FIELD_RE.finditer(fields_str):
+                            field_name = field_match.group(1).lower()
+                            field_value = field_match.group(2).strip()
+                            # Remove extra braces
+                            field_value = field_value.translate(_BRACE_DEL)
+                            fields[field_name] = field_value
+                        
+                        yield Entry(entry_type.lower(), cite_key, fields)
         
         except Exception as e:
             inkex.errormsg(f"Error parsing BibTeX file: {str(e)}")
-            return []
-        
-        return entries
+    
+    def parse_bibtex_native(self, data):
+        """Parse BibTeX data with the compiled bibtex_parser extension."""
+        library = bibtex_parser.parse_str(data.decode('utf-8'))
+        
+        for item in library.entries:
+            fields = {}
+            for field_name, field_value in dict(item.fields).items():
+                fields[field_name.lower()] = str(field_value).strip().translate(_BRACE_DEL)
+            
+            yield Entry(item.entry_type.lower(), item.key.strip(), fields)
     
     def parse_ris(self, filepath):
         """Parse RIS format file."""
-        entries = []
-        
         try:
             with open(filepath, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            # Split by record separator
-            records = content.split('ER  -')
-            
-            for record in records:
-                if not record.strip():
-                    continue
-                
                 fields = {}
                 entry_type = 'article'
                 
-                # Parse RIS tags
-                for line in record.split('\n'):
+                # Parse RIS tags line by line, one record at a time
+                for line in f:
                     line = line.strip()
                     if not line or '  -' not in line:
                         continue
@@ -211,46 +354,30 @@ class BibTeXLoader(inkex.EffectExtension):
                     tag = tag.strip()
                     value = value.strip()
                     
-                    if tag == 'TY':
+                    if tag == 'ER':
+                        # End of record
+                        if fields:
+                            yield Entry(entry_type, fields.get('title', 'unknown')[:20], fields)
+                        fields = {}
+                        entry_type = 'article'
+                    elif tag == 'TY':
                         entry_type = value.lower()
-                    elif tag == 'AU':
-                        if 'author' in fields:
-                            fields['author'] += ' and ' + value
-                        else:
-                            fields['author'] = value
-                    elif tag == 'TI':
-                        fields['title'] = value
-                    elif tag == 'PY':
-                        fields['year'] = value.split('/')[0]  # Extract year
-                    elif tag == 'JO' or tag == 'JF' or tag == 'T2':
-                        fields['journal'] = value
-                    elif tag == 'VL':
-                        fields['volume'] = value
-                    elif tag == 'IS':
-                        fields['number'] = value
-                    elif tag == 'SP':
-                        fields['pages'] = value
-                    elif tag == 'EP' and 'pages' in fields:
-                        fields['pages'] += '-' + value
-                    elif tag == 'PB':
-                        fields['publisher'] = value
+                    else:
+                        handler = _RIS_TAGS.get(tag)
+                        if handler is not None:
+                            field_name, setter = handler
+                            setter(fields, field_name, value)
                 
+                # Last record may not be terminated by ER
                 if fields:
-                    entries.append({
-                        'type': entry_type,
-                        'key': fields.get('title', 'unknown')[:20],
-                        'fields': fields
-                    })
+                    yield Entry(entry_type, fields.get('title', 'unknown')[:20], fields)
         
         except Exception as e:
             inkex.errormsg(f"Error parsing RIS file: {str(e)}")
-            return []
-        
-        return entries
     
     def parse_json(self, filepath):
         """Parse JSON format file (CSL JSON)."""
-        entries = []
+        import json
         
         try:
             with open(filepath, 'r', encoding='utf-8') as f:
@@ -299,39 +426,28 @@ class BibTeXLoader(inkex.EffectExtension):
                 if 'journal' in entry_type:
                     entry_type = 'article'
                 
-                entries.append({
-                    'type': entry_type,
-                    'key': item.get('id', fields.get('title', 'unknown')[:20]),
-                    'fields': fields
-                })
+                yield Entry(entry_type, item.get('id', fields.get('title', 'unknown')[:20]), fields)
         
         except Exception as e:
             inkex.errormsg(f"Error parsing JSON file: {str(e)}")
-            return []
-        
-        return entries
     
     def parse_endnote(self, filepath):
         """Parse EndNote format file."""
-        entries = []
-        
         try:
             with open(filepath, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            # Split by record separator
-            records = re.split(r'\n\s*\n', content)
-            
-            for record in records:
-                if not record.strip():
-                    continue
-                
                 fields = {}
                 entry_type = 'article'
                 
-                # Parse EndNote tags
-                for line in record.split('\n'):
-                    if not line.strip() or not line.startswith('%'):
+                # Records are separated by blank lines
+                for line in f:
+                    if not line.strip():
+                        if fields:
+                            yield Entry(entry_type, fields.get('title', 'unknown')[:20], fields)
+                        fields = {}
+                        entry_type = 'article'
+                        continue
+                    
+                    if not line.startswith('%'):
                         continue
                     
                     tag = line[1]
@@ -339,259 +455,200 @@ class BibTeXLoader(inkex.EffectExtension):
                     
                     if tag == '0':
                         entry_type = value.lower()
-                    elif tag == 'A':
-                        if 'author' in fields:
-                            fields['author'] += ' and ' + value
-                        else:
-                            fields['author'] = value
-                    elif tag == 'T':
-                        fields['title'] = value
-                    elif tag == 'D':
-                        fields['year'] = value[:4]
-                    elif tag == 'J':
-                        fields['journal'] = value
-                    elif tag == 'V':
-                        fields['volume'] = value
-                    elif tag == 'N':
-                        fields['number'] = value
-                    elif tag == 'P':
-                        fields['pages'] = value
-                    elif tag == 'I':
-                        fields['publisher'] = value
+                        continue
+                    
+                    handler = _ENDNOTE_TAGS.get(tag)
+                    if handler is not None:
+                        field_name, setter = handler
+                        setter(fields, field_name, value)
                 
                 if fields:
-                    entries.append({
-                        'type': entry_type,
-                        'key': fields.get('title', 'unknown')[:20],
-                        'fields': fields
-                    })
+                    yield Entry(entry_type, fields.get('title', 'unknown')[:20], fields)
         
         except Exception as e:
             inkex.errormsg(f"Error parsing EndNote file: {str(e)}")
-            return []
-        
-        return entries
     
-    def sort_entries(self, entries):
-        """Sort entries based on selected order."""
-        if self.options.sort_order == 'author':
-            return sorted(entries, key=lambda x: x['fields'].get('author', '').lower())
-        elif self.options.sort_order == 'year':
-            return sorted(entries, key=lambda x: x['fields'].get('year', '9999'))
-        elif self.options.sort_order == 'title':
-            return sorted(entries, key=lambda x: x['fields'].get('title', '').lower())
-        else:  # appearance
+    # Sort order -> key function; sorted() evaluates it once per entry
+    _SORT_KEYS = {
+        'author': lambda entry: entry.fields.get('author', '').casefold(),
+        'year': lambda entry: entry.fields.get('year', '9999'),
+        'title': lambda entry: entry.fields.get('title', '').casefold(),
+    }
+    
+    def sort_entries(self, entries, sort_order):
+        """Sort entries based on selected order.
+        
+        Entries are only materialized when sorting; for appearance order the
+        iterable is returned unchanged.
+        """
+        sort_key = self._SORT_KEYS.get(sort_order)
+        if sort_key is None:  # appearance
             return entries
+        return sorted(entries, key=sort_key)
     
-    def format_with_python(self, entries):
-        """Format references using Python."""
-        refs = []
-        format_style = self.options.format
+    def format_with_python(self, entries, format_style):
+        """Format references using Python, consuming entries in a single pass."""
+        format_entry = self._compile_style(format_style)
         
-        for entry in entries:
-            formatted = self.format_entry_python(entry, format_style)
-            if formatted:
-                refs.append(formatted)
-        
-        return refs
+        return [ref for ref in (format_entry(entry) for entry in entries) if ref]
     
-    def get_numbering_marker(self, index):
-        """Get the numbering marker based on style."""
-        style = self.options.numbering_style
-        
-        if style == 'numeric':
-            return f"[{index}]"
-        elif style == 'numeric_dot':
-            return f"{index}."
-        elif style == 'numeric_paren':
-            return f"({index})"
-        elif style == 'bullet':
-            return "•"
-        elif style == 'dash':
-            return "–"
-        elif style == 'asterisk':
-            return "*"
-        elif style == 'symbols':
-            symbols = ['*', '†', '‡', '§', '¶', '‖', '**', '††', '‡‡']
-            if index - 1 < len(symbols):
-                return symbols[index - 1]
-            else:
-                return f"[{index}]"
-        elif style == 'alpha':
-            if index <= 26:
-                return f"{chr(96 + index)}."
-            else:
-                return f"[{index}]"
-        elif style == 'roman':
-            roman_numerals = ['i', 'ii', 'iii', 'iv', 'v', 'vi', 'vii', 'viii', 'ix', 'x',
-                            'xi', 'xii', 'xiii', 'xiv', 'xv', 'xvi', 'xvii', 'xviii', 'xix', 'xx']
-            if index - 1 < len(roman_numerals):
-                return f"{roman_numerals[index - 1]}."
-            else:
-                return f"[{index}]"
-        elif style == 'none':
-            return ""
-        else:
-            return f"[{index}]"
+    # Numbering style -> marker builder for a 1-based index
+    _MARKER_FUNCS = {
+        'numeric': lambda index: f"[{index}]",
+        'numeric_dot': lambda index: f"{index}.",
+        'numeric_paren': lambda index: f"({index})",
+        'bullet': lambda index: "•",
+        'dash': lambda index: "–",
+        'asterisk': lambda index: "*",
+        'symbols': lambda index: _SYMBOLS[index - 1] if index <= len(_SYMBOLS) else f"[{index}]",
+        'alpha': lambda index: f"{chr(96 + index)}." if index <= 26 else f"[{index}]",
+        'roman': lambda index: f"{_ROMAN[index - 1]}." if index <= len(_ROMAN) else f"[{index}]",
+        'none': lambda index: "",
+    }
     
-    def format_entry_python(self, entry, style):
-        """Format a single entry according to the specified style."""
-        fields = entry['fields']
-        entry_type = entry['type']
-        
-        # Common field extractions
-        authors = self.format_authors(fields.get('author', ''), style)
-        year = fields.get('year', 'n.d.')
-        title = fields.get('title', '')
-        
-        # Style-specific formatting
-        if style == 'apa' or style == 'apa7':
-            return self.format_apa(entry_type, authors, year, title, fields)
-        elif style == 'mla':
-            return self.format_mla(entry_type, authors, year, title, fields)
-        elif style == 'chicago':
-            return self.format_chicago(entry_type, authors, year, title, fields)
-        elif style == 'harvard':
-            return self.format_harvard(entry_type, authors, year, title, fields)
-        elif style == 'ieee':
-            return self.format_ieee(entry_type, authors, year, title, fields)
-        elif style == 'vancouver':
-            return self.format_vancouver(entry_type, authors, year, title, fields)
-        elif style == 'ama':
-            return self.format_ama(entry_type, authors, year, title, fields)
-        elif style == 'acs':
-            return self.format_acs(entry_type, authors, year, title, fields)
-        elif style == 'nature':
-            return self.format_nature(entry_type, authors, year, title, fields)
-        else:
-            return self.format_apa(entry_type, authors, year, title, fields)
+    @staticmethod
+    def get_numbering_marker(index, style):
+        """Get the numbering marker for a 1-based index in the given style."""
+        marker_func = BibTeXLoader._MARKER_FUNCS.get(style)
+        if marker_func is None:
+            return f"[{index}]"
+        return marker_func(index)
     
-    def format_authors(self, author_str, style):
-        """Format author names according to style."""
-        if not author_str:
-            return ''
+    def _compile_style(self, style):
+        """Build a single-entry formatter specialized for a citation style.
         
-        authors = [a.strip() for a in author_str.replace(' and ', ', ').split(',')]
-        authors = [a for a in authors if a]
+        The style and author formatters are resolved once here, so the
+        returned function only does the per-entry work.
+        """
+        formatter = self._FORMATTERS.get(style, BibTeXLoader.format_apa)
+        author_formatter = self._pick_author_formatter(style)
         
-        if style in ['apa', 'apa7', 'chicago', 'harvard']:
-            # Last, F. M. format
-            formatted = []
-            for author in authors:
-                parts = author.split()
-                if len(parts) > 1:
-                    last = parts[-1]
-                    initials = '. '.join([p[0] for p in parts[:-1] if p]) + '.'
-                    formatted.append(f"{last}, {initials}")
-                else:
-                    formatted.append(author)
+        def format_entry(entry):
+            fields = entry.fields
             
-            if len(formatted) > 2:
-                return ', '.join(formatted[:-1]) + ', & ' + formatted[-1]
-            elif len(formatted) == 2:
-                return f"{formatted[0]} & {formatted[1]}"
-            else:
-                return formatted[0] if formatted else ''
+            # Common field extractions
+            author_str = fields.get('author', '')
+            authors = author_formatter(author_str) if author_str else ''
+            year = fields.get('year', 'n.d.')
+            title = fields.get('title', '')
+            
+            return formatter(self, entry.type, authors, year, title, fields)
         
+        return format_entry
+    
+    def _pick_author_formatter(self, style):
+        """Return the author-list formatter used by a citation style."""
+        if style in ['apa', 'apa7', 'chicago', 'harvard']:
+            return self._format_authors_initials
         elif style == 'mla':
-            # Last, First Middle format
-            if len(authors) > 1:
-                return authors[0] + ', et al.'
-            return authors[0]
-        
+            return self._format_authors_mla
         elif style in ['ieee', 'vancouver', 'nature']:
-            # Abbreviated format
-            formatted = []
-            for author in authors[:6]:  # Limit to 6 authors
-                parts = author.split()
-                if len(parts) > 1:
-                    initials = ''.join([p[0] for p in parts[:-1] if p])
-                    formatted.append(f"{parts[-1]} {initials}")
-                else:
-                    formatted.append(author)
-            
-            if len(authors) > 6:
-                return ', '.join(formatted) + ', et al.'
-            return ', '.join(formatted)
+            return self._format_authors_abbreviated
+        else:
+            return self._format_authors_plain
+    
+    def _split_authors(self, author_str):
+        """Split an author string into individual names."""
+        return [a for a in (part.strip() for part in _AUTHOR_SPLIT_RE.split(author_str)) if a]
+    
+    def _format_authors_initials(self, author_str):
+        """Last, F. M. format."""
+        formatted = []
+        for author in self._split_authors(author_str):
+            *given, last = author.split()
+            if given:
+                formatted.append(f"{last}, {' '.join(f'{p[0]}.' for p in given)}")
+            else:
+                formatted.append(author)
         
+        if len(formatted) > 2:
+            return ', '.join(formatted[:-1]) + ', & ' + formatted[-1]
+        elif len(formatted) == 2:
+            return f"{formatted[0]} & {formatted[1]}"
         else:
-            return ', '.join(authors)
+            return formatted[0] if formatted else ''
+    
+    def _format_authors_mla(self, author_str):
+        """Last, First Middle format."""
+        authors = self._split_authors(author_str)
+        if len(authors) > 1:
+            return authors[0] + ', et al.'
+        return authors[0]
+    
+    def _format_authors_abbreviated(self, author_str):
+        """Abbreviated Last FM format, limited to 6 authors."""
+        authors = self._split_authors(author_str)
+        formatted = []
+        for author in authors[:6]:
+            *given, last = author.split()
+            if given:
+                formatted.append(f"{last} {''.join(p[0] for p in given)}")
+            else:
+                formatted.append(author)
+        
+        if len(authors) > 6:
+            return ', '.join(formatted) + ', et al.'
+        return ', '.join(formatted)
+    
+    def _format_authors_plain(self, author_str):
+        """Comma-separated names as given."""
+        return ', '.join(self._split_authors(author_str))
     
     def format_apa(self, entry_type, authors, year, title, fields):
         """APA format."""
-        parts = []
-        
-        if authors:
-            parts.append(f"{authors} ({year}).")
-        else:
-            parts.append(f"({year}).")
+        head = f"{authors} ({year})." if authors else f"({year})."
         
         if entry_type == 'article':
-            parts.append(f"{title}.")
-            if 'journal' in fields:
-                journal = fields['journal']
-                vol_str = f"{journal}"
-                if 'volume' in fields:
-                    vol_str += f", {fields['volume']}"
-                if 'number' in fields:
-                    vol_str += f"({fields['number']})"
-                if 'pages' in fields:
-                    vol_str += f", {fields['pages']}"
-                parts.append(vol_str + ".")
-        else:
-            parts.append(f"{title}.")
-            if 'publisher' in fields:
-                parts.append(f"{fields['publisher']}.")
-        
-        return ' '.join(parts)
+            journal = fields.get('journal')
+            if journal:
+                volume = fields.get('volume')
+                number = fields.get('number')
+                pages = fields.get('pages')
+                volume_part = f", {volume}" if volume else ''
+                number_part = f"({number})" if number else ''
+                pages_part = f", {pages}" if pages else ''
+                return f"{head} {title}. {journal}{volume_part}{number_part}{pages_part}."
+            return f"{head} {title}."
+        
+        publisher = fields.get('publisher')
+        publisher_part = f" {publisher}." if publisher else ''
+        return f"{head} {title}.{publisher_part}"
     
     def format_mla(self, entry_type, authors, year, title, fields):
         """MLA format."""
-        parts = []
-        
-        if authors:
-            parts.append(f'{authors}.')
-        
-        parts.append(f'"{title}."')
-        
-        if entry_type == 'article' and 'journal' in fields:
-            parts.append(f"{fields['journal']},")
-            if 'volume' in fields:
-                parts.append(f"vol. {fields['volume']},")
-            if 'number' in fields:
-                parts.append(f"no. {fields['number']},")
-            parts.append(f"{year},")
-            if 'pages' in fields:
-                parts.append(f"pp. {fields['pages']}.")
-        else:
-            if 'publisher' in fields:
-                parts.append(f"{fields['publisher']}, {year}.")
-        
-        return ' '.join(parts)
+        author_part = f"{authors}. " if authors else ''
+        journal = fields.get('journal')
+        
+        if entry_type == 'article' and journal:
+            volume = fields.get('volume')
+            number = fields.get('number')
+            pages = fields.get('pages')
+            volume_part = f" vol. {volume}," if volume else ''
+            number_part = f" no. {number}," if number else ''
+            pages_part = f" pp. {pages}." if pages else ''
+            return f'{author_part}"{title}." {journal},{volume_part}{number_part} {year},{pages_part}'
+        
+        publisher = fields.get('publisher')
+        publisher_part = f" {publisher}, {year}." if publisher else ''
+        return f'{author_part}"{title}."{publisher_part}'
     
     def format_chicago(self, entry_type, authors, year, title, fields):
         """Chicago format."""
-        parts = []
-        
-        if authors:
-            parts.append(f"{authors}.")
-        
-        parts.append(f'{year}. "{title}."')
-        
-        if entry_type == 'article' and 'journal' in fields:
-            journal_part = fields['journal']
-            if 'volume' in fields:
-                journal_part += f" {fields['volume']}"
-            if 'number' in fields:
-                journal_part += f", no. {fields['number']}"
-            if 'pages' in fields:
-                journal_part += f": {fields['pages']}"
-            parts.append(journal_part + ".")
-        else:
-            if 'publisher' in fields:
-                parts.append(f"{fields['publisher']}.")
-        
-        return ' '.join(parts)
+        author_part = f"{authors}. " if authors else ''
+        journal = fields.get('journal')
+        
+        if entry_type == 'article' and journal:
+            volume = fields.get('volume')
+            number = fields.get('number')
+            pages = fields.get('pages')
+            volume_part = f" {volume}" if volume else ''
+            number_part = f", no. {number}" if number else ''
+            pages_part = f": {pages}" if pages else ''
+            return f'{author_part}{year}. "{title}." {journal}{volume_part}{number_part}{pages_part}.'
+        
+        publisher = fields.get('publisher')
+        publisher_part = f" {publisher}." if publisher else ''
+        return f'{author_part}{year}. "{title}."{publisher_part}'
     
     def format_harvard(self, entry_type, authors, year, title, fields):
         """Harvard format."""
@@ -599,161 +656,129 @@ class BibTeXLoader(inkex.EffectExtension):
     
     def format_ieee(self, entry_type, authors, year, title, fields):
         """IEEE format."""
-        parts = []
-        
-        if authors:
-            parts.append(f'{authors},')
-        
-        parts.append(f'"{title},"')
-        
-        if entry_type == 'article' and 'journal' in fields:
-            journal_part = fields['journal']
-            if 'volume' in fields:
-                journal_part += f", vol. {fields['volume']}"
-            if 'number' in fields:
-                journal_part += f", no. {fields['number']}"
-            if 'pages' in fields:
-                journal_part += f", pp. {fields['pages']}"
-            parts.append(journal_part + f", {year}.")
-        else:
-            if 'publisher' in fields:
-                parts.append(f"{fields['publisher']}, {year}.")
-        
-        return ' '.join(parts)
+        author_part = f"{authors}, " if authors else ''
+        journal = fields.get('journal')
+        
+        if entry_type == 'article' and journal:
+            volume = fields.get('volume')
+            number = fields.get('number')
+            pages = fields.get('pages')
+            volume_part = f", vol. {volume}" if volume else ''
+            number_part = f", no. {number}" if number else ''
+            pages_part = f", pp. {pages}" if pages else ''
+            return f'{author_part}"{title}," {journal}{volume_part}{number_part}{pages_part}, {year}.'
+        
+        publisher = fields.get('publisher')
+        publisher_part = f" {publisher}, {year}." if publisher else ''
+        return f'{author_part}"{title},"{publisher_part}'
     
     def format_vancouver(self, entry_type, authors, year, title, fields):
         """Vancouver format."""
-        parts = []
-        
-        if authors:
-            parts.append(f"{authors}.")
-        
-        parts.append(f"{title}.")
-        
-        if entry_type == 'article' and 'journal' in fields:
-            parts.append(f"{fields['journal']}.")
-            if 'year' in fields:
-                date_str = year
-                if 'month' in fields:
-                    date_str = f"{year} {fields['month']}"
-                parts.append(f"{date_str};")
-            if 'volume' in fields:
-                vol_str = fields['volume']
-                if 'number' in fields:
-                    vol_str += f"({fields['number']})"
-                if 'pages' in fields:
-                    vol_str += f":{fields['pages']}"
-                parts.append(vol_str + ".")
-        else:
-            if 'publisher' in fields:
-                parts.append(f"{fields['publisher']}; {year}.")
-        
-        return ' '.join(parts)
+        author_part = f"{authors}. " if authors else ''
+        journal = fields.get('journal')
+        
+        if entry_type == 'article' and journal:
+            month = fields.get('month')
+            volume = fields.get('volume')
+            date_part = ''
+            if fields.get('year'):
+                date_part = f" {year} {month};" if month else f" {year};"
+            volume_part = ''
+            if volume:
+                number = fields.get('number')
+                pages = fields.get('pages')
+                number_part = f"({number})" if number else ''
+                pages_part = f":{pages}" if pages else ''
+                volume_part = f" {volume}{number_part}{pages_part}."
+            return f"{author_part}{title}. {journal}.{date_part}{volume_part}"
+        
+        publisher = fields.get('publisher')
+        publisher_part = f" {publisher}; {year}." if publisher else ''
+        return f"{author_part}{title}.{publisher_part}"
     
     def format_ama(self, entry_type, authors, year, title, fields):
         """AMA format."""
-        parts = []
-        
-        if authors:
-            parts.append(f"{authors}.")
-        
-        parts.append(f"{title}.")
-        
-        if entry_type == 'article' and 'journal' in fields:
-            journal = fields['journal']
-            parts.append(f"{journal}.")
-            if 'year' in fields:
-                parts.append(f"{year};")
-            if 'volume' in fields:
-                vol_str = fields['volume']
-                if 'number' in fields:
-                    vol_str += f"({fields['number']})"
-                if 'pages' in fields:
-                    vol_str += f":{fields['pages']}"
-                parts.append(vol_str + ".")
-        else:
-            if 'publisher' in fields:
-                parts.append(f"{fields['publisher']}; {year}.")
-        
-        return ' '.join(parts)
+        author_part = f"{authors}. " if authors else ''
+        journal = fields.get('journal')
+        
+        if entry_type == 'article' and journal:
+            volume = fields.get('volume')
+            date_part = f" {year};" if fields.get('year') else ''
+            volume_part = ''
+            if volume:
+                number = fields.get('number')
+                pages = fields.get('pages')
+                number_part = f"({number})" if number else ''
+                pages_part = f":{pages}" if pages else ''
+                volume_part = f" {volume}{number_part}{pages_part}."
+            return f"{author_part}{title}. {journal}.{date_part}{volume_part}"
+        
+        publisher = fields.get('publisher')
+        publisher_part = f" {publisher}; {year}." if publisher else ''
+        return f"{author_part}{title}.{publisher_part}"
     
     def format_acs(self, entry_type, authors, year, title, fields):
         """ACS format."""
-        parts = []
-        
-        if authors:
-            parts.append(f"{authors}.")
-        
-        parts.append(f"{title}.")
-        
-        if entry_type == 'article' and 'journal' in fields:
-            journal_part = fields['journal']
-            if 'year' in fields:
-                journal_part += f" {year}"
-            if 'volume' in fields:
-                journal_part += f", {fields['volume']}"
-            if 'pages' in fields:
-                journal_part += f", {fields['pages']}"
-            parts.append(journal_part + ".")
-        else:
-            if 'publisher' in fields:
-                parts.append(f"{fields['publisher']}: {year}.")
-        
-        return ' '.join(parts)
+        author_part = f"{authors}. " if authors else ''
+        journal = fields.get('journal')
+        
+        if entry_type == 'article' and journal:
+            volume = fields.get('volume')
+            pages = fields.get('pages')
+            date_part = f" {year}" if fields.get('year') else ''
+            volume_part = f", {volume}" if volume else ''
+            pages_part = f", {pages}" if pages else ''
+            return f"{author_part}{title}. {journal}{date_part}{volume_part}{pages_part}."
+        
+        publisher = fields.get('publisher')
+        publisher_part = f" {publisher}: {year}." if publisher else ''
+        return f"{author_part}{title}.{publisher_part}"
     
     def format_nature(self, entry_type, authors, year, title, fields):
         """Nature format."""
-        parts = []
-        
-        if authors:
-            parts.append(f"{authors}.")
-        
-        parts.append(f"{title}.")
-        
-        if entry_type == 'article' and 'journal' in fields:
-            journal = fields['journal']
-            vol_str = journal
-            if 'volume' in fields:
-                vol_str += f" {fields['volume']},"
-            if 'pages' in fields:
-                vol_str += f" {fields['pages']}"
-            vol_str += f" ({year})"
-            parts.append(vol_str + ".")
-        else:
-            if 'publisher' in fields:
-                parts.append(f"({fields['publisher']}, {year}).")
-        
-        return ' '.join(parts)
+        author_part = f"{authors}. " if authors else ''
+        journal = fields.get('journal')
+        
+        if entry_type == 'article' and journal:
+            volume = fields.get('volume')
+            pages = fields.get('pages')
+            volume_part = f" {volume}," if volume else ''
+            pages_part = f" {pages}" if pages else ''
+            return f"{author_part}{title}. {journal}{volume_part}{pages_part} ({year})."
+        
+        publisher = fields.get('publisher')
+        publisher_part = f" ({publisher}, {year})." if publisher else ''
+        return f"{author_part}{title}.{publisher_part}"
     
-    def wrap_text(self, text, max_width_chars, first_line_indent=0, subsequent_indent=0):
-        """Wrap text to fit within max width with optional indentation."""
-        words = text.split()
-        lines = []
-        
-        # Adjust max width for first line
-        first_line_max = max_width_chars - first_line_indent
-        subsequent_max = max_width_chars - subsequent_indent
-        
-        current_line = []
-        current_length = 0
-        is_first_line = True
-        
-        for word in words:
-            word_length = len(word)
-            max_line_length = first_line_max if is_first_line else subsequent_max
-            
-            if current_length + word_length + len(current_line) <= max_line_length:
-                current_line.append(word)
-                current_length += word_length
-            else:
-                if current_line:
-                    lines.append(' '.join(current_line))
-                    is_first_line = False
-                current_line = [word]
-                current_length = word_length
+    # Citation style -> formatter (plain functions, called with self)
+    _FORMATTERS = {
+        'apa': format_apa,
+        'apa7': format_apa,
+        'mla': format_mla,
+        'chicago': format_chicago,
+        'harvard': format_harvard,
+        'ieee': format_ieee,
+        'vancouver': format_vancouver,
+        'ama': format_ama,
+        'acs': format_acs,
+        'nature': format_nature,
+    }
+    
+    def wrap_text(self, wrapper, text, subsequent_indent=0):
+        """Wrap text with a shared TextWrapper, with optional indentation.
         
-        if current_line:
-            lines.append(' '.join(current_line))
+        Lines after the first are wrapped subsequent_indent characters
+        narrower. The indent itself is applied by the caller as an x offset,
+        so it is stripped from the returned lines.
+        """
+        if bibtex_wrap is not None:
+            return bibtex_wrap.wrap_text(text, wrapper.width, subsequent_indent)
+        
+        wrapper.subsequent_indent = ' ' * subsequent_indent
+        lines = wrapper.wrap(' '.join(text.split()))
+        
+        if subsequent_indent:
+            lines[1:] = [line[subsequent_indent:] for line in lines[1:]]
         
         return lines
     
@@ -775,360 +800,300 @@ class BibTeXLoader(inkex.EffectExtension):
         }
         return font_map.get(self.options.font_family, 'serif')
     
-#     # LaTeX Backend Methods
+    # LaTeX Backend Methods
     
-#     def add_references_latex(self, formatted_refs, entries):
-#         """Add references using LaTeX rendering."""
-#         latex_content = self.build_latex_bibliography(formatted_refs, entries)
-        
-#         # Debug: show generated LaTeX
-#         inkex.utils.debug("Generated LaTeX for bibliography:")
-#         inkex.utils.debug(latex_content[:500])
+    def add_references_latex(self, formatted_refs, markers):
+        """Add references using LaTeX rendering."""
+        latex_content = self.build_latex_bibliography(formatted_refs, markers)
         
-#         # Render LaTeX to SVG
-#         svg_file = self.render_latex_to_svg(latex_content)
-#         self.import_latex_svg(svg_file)
+        # Render LaTeX to SVG
+        svg_file = self.render_latex_to_svg(latex_content)
+        self.import_latex_svg(svg_file)
     
-#     def build_latex_bibliography(self, formatted_refs, entries):
-#         """Build LaTeX document for bibliography."""
+    def build_latex_bibliography(self, formatted_refs, markers):
+        """Build LaTeX document for bibliography."""
         
-#         # Default packages
-#         packages = r"""\usepackage[utf8]{inputenc}
-# \usepackage{geometry}
-# \geometry{paperwidth=30in, paperheight=30in, margin=0.5in}"""
+        # Default packages
+        packages = r"""\usepackage[utf8]{inputenc}
+\usepackage{geometry}
+\geometry{paperwidth=30in, paperheight=30in, margin=0.5in}"""
         
-#         # Add user packages
-#         if self.options.latex_packages:
-#             packages += "\n" + self.options.latex_packages
+        # Add user packages
+        if self.options.latex_packages:
+            packages += "\n" + self.options.latex_packages
         
-#         # Add user preamble
-#         if self.options.latex_preamble:
-#             packages += "\n" + self.options.latex_preamble
+        # Add user preamble
+        if self.options.latex_preamble:
+            packages += "\n" + self.options.latex_preamble
         
-#         # Build bibliography content
-#         bib_items = []
+        # Build bibliography content
+        bib_items = []
         
-#         # Add title if needed
-#         if self.options.show_title:
-#             title_size = self.get_latex_font_size(self.options.font_size + 2)
-#             bib_items.append(f"\\noindent{{{title_size}\\textbf{{{self.escape_latex(self.options.title_text)}}}}}\\\\[0.5em]")
-        
-#         # Add each reference
-#         font_size_cmd = self.get_latex_font_size(self.options.font_size)
+        # Add title if needed
+        if self.options.show_title:
+            title_size = self.get_latex_font_size(self.options.font_size + 2)
+            bib_items.append(f"\\noindent{{{title_size}\\textbf{{{self.escape_latex(self.options.title_text)}}}}}\\\\[0.5em]")
+        
+        # Add each reference; markers and references are escaped up front in
+        # two batches and the per-item prefix and suffix are shared by every
+        # reference
+        font_size_cmd = self.get_latex_font_size(self.options.font_size)
+        if self.options.hanging_indent:
+            indent_pt = self.options.indent_size * 0.75  # Convert px to pt approximately
+            prefix = f"\\hangindent={indent_pt}pt\n\\noindent {font_size_cmd}{{}}"
+        else:
+            prefix = f"\\noindent {font_size_cmd}{{}}"
+        suffix = f"\\\\[{self.options.line_spacing - 1}em]"
+        
+        escaped_markers = self.escape_latex_batch(markers)
+        escaped_refs = self.escape_latex_batch(formatted_refs)
+        for marker, ref_esc in zip(escaped_markers, escaped_refs):
+            if marker:
+                bib_items.append(f"{prefix}{marker} {ref_esc}{suffix}")
+            else:
+                bib_items.append(f"{prefix}{ref_esc}{suffix}")
+        
+        content = "\n\n".join(bib_items)
+        
+        # Build document
+        document = rf"""\documentclass{{article}}
+{packages}
+\pagestyle{{empty}}
+\setlength{{\parindent}}{{0pt}}
+\begin{{document}}
+{content}
+\end{{document}}
+"""
         
-#         for i, ref in enumerate(formatted_refs, 1):
-#             marker = self.get_numbering_marker(i)
-            
-#             if self.options.hanging_indent:
-#                 # Use hanging indent environment
-#                 indent_pt = self.options.indent_size * 0.75  # Convert px to pt approximately
-#                 ref_text = f"{marker} {ref}" if marker else ref
-#                 bib_items.append(
-#                     f"\\hangindent={indent_pt}pt\n"
-#                     f"\\noindent {font_size_cmd}{self.escape_latex(ref_text)}\\\\[{self.options.line_spacing - 1}em]"
-#                 )
-#             else:
-#                 ref_text = f"{marker} {ref}" if marker else ref
-#                 bib_items.append(f"\\noindent {font_size_cmd}{self.escape_latex(ref_text)}\\\\[{self.options.line_spacing - 1}em]")
-        
-#         content = "\n\n".join(bib_items)
-        
-#         # Build document
-#         document = rf"""\documentclass{{article}}
-# {packages}
-# \pagestyle{{empty}}
-# \setlength{{\parindent}}{{0pt}}
-# \begin{{document}}
-# {content}
-# \end{{document}}
-# """
-        
-#         return document
+        return document
     
-#     def get_latex_font_size(self, size):
-#         """Convert pixel font size to LaTeX size command."""
-#         if size <= 8:
-#             return r"\tiny"
-#         elif size <= 10:
-#             return r"\scriptsize"
-#         elif size <= 11:
-#             return r"\footnotesize"
-#         elif size <= 12:
-#             return r"\small"
-#         elif size <= 14:
-#             return r"\normalsize"
-#         elif size <= 17:
-#             return r"\large"
-#         elif size <= 20:
-#             return r"\Large"
-#         elif size <= 25:
-#             return r"\LARGE"
-#         else:
-#             return r"\huge"
+    def get_latex_font_size(self, size):
+        """Convert pixel font size to LaTeX size command."""
+        return _SIZE_CMDS[bisect.bisect_left(_SIZE_BREAKS, size)]
     
-    # def escape_latex(self, text):
-    #     """Escape special LaTeX characters."""
-    #     if not text:
-    #         return ""
-    #     replacements = {
-    #         '\\': r'\textbackslash{}',
-    #         '&': r'\&',
-    #         '%': r'\%',
-    #         '$': r'\$',
-    #         '#': r'\#',
-    #         '_': r'\_',
-    #         '{': r'\{',
-    #         '}': r'\}',
-    #         '~': r'\textasciitilde{}',
-    #         '^': r'\textasciicircum{}'
-    #     }
-    #     for old, new in replacements.items():
-    #         text = text.replace(old, new)
-    #     return text
+    def escape_latex(self, text):
+        """Escape special LaTeX characters."""
+        if not text:
+            return ""
+        return _LATEX_SPECIAL_RE.sub(lambda m: _LATEX_MAP[m.group()], text)
     
-    # def render_latex_to_svg(self, latex_content):
-    #     """Compile LaTeX to PDF then convert to SVG."""
-    #     tmpdir = tempfile.mkdtemp(prefix='inkscape_bibtex_')
-        
-    #     try:
-    #         tex_file = os.path.join(tmpdir, 'bibliography.tex')
-    #         pdf_file = os.path.join(tmpdir, 'bibliography.pdf')
-    #         svg_file = os.path.join(tmpdir, 'bibliography.svg')
-            
-    #         # Write LaTeX file
-    #         with open(tex_file, 'w', encoding='utf-8') as f:
-    #             f.write(latex_content)
-            
-    #         inkex.utils.debug(f"LaTeX file written to: {tex_file}")
-            
-    #         # Compile LaTeX to PDF
-    #         result = subprocess.run(
-    #             ['pdflatex', '-interaction=nonstopmode', '-halt-on-error', 
-    #              '-output-directory', tmpdir, tex_file],
-    #             capture_output=True,
-    #             text=True,
-    #             timeout=30,
-    #             cwd=tmpdir
-    #         )
-            
-    #         if result.returncode != 0 or not os.path.exists(pdf_file):
-    #             error_msg = f"LaTeX compilation failed:\nSTDOUT:\n{result.stdout}\n\nSTDERR:\n{result.stderr}"
-    #             raise Exception(error_msg)
+    def escape_latex_batch(self, texts):
+        """Escape special LaTeX characters in each of a list of texts."""
+        if bibtex_wrap is not None:
+            return bibtex_wrap.escape_latex_batch(texts, _LATEX_MAP)
+        return [self.escape_latex(text) for text in texts]
+    
+    def render_latex_to_svg(self, latex_content):
+        """Compile LaTeX to PDF then convert to SVG."""
+        # Only needed by the LaTeX backend, so imported here to keep startup fast
+        import atexit
+        import subprocess
+        import tempfile
+        import shutil
+        
+        tmpdir = tempfile.mkdtemp(prefix='inkscape_bibtex_')
+        
+        try:
+            tex_file = os.path.join(tmpdir, 'bibliography.tex')
+            pdf_file = os.path.join(tmpdir, 'bibliography.pdf')
+            svg_file = os.path.join(tmpdir, 'bibliography.svg')
             
-    #         inkex.utils.debug(f"PDF created: {pdf_file}")
+            # Write LaTeX file
+            Path(tex_file).write_text(latex_content, encoding='utf-8')
             
-    #         # Convert PDF to SVG
-    #         svg_created = False
+            # Compile LaTeX to PDF
+            result = subprocess.run(
+                ['pdflatex', '-interaction=nonstopmode', '-halt-on-error', 
+                 '-output-directory', tmpdir, tex_file],
+                capture_output=True,
+                timeout=30,
+                cwd=tmpdir
+            )
             
-    #         # Method 1: Using inkex.command.inkscape
-    #         try:
-    #             inkex.command.inkscape(
-    #                 pdf_file,
-    #                 export_filename=svg_file,
-    #                 pdf_poppler=True,
-    #                 export_type='svg',
-    #                 export_text_to_path=True,
-    #                 export_area_drawing=True
-    #             )
-    #             if os.path.exists(svg_file):
-    #                 svg_created = True
-    #                 inkex.utils.debug("Method 1 (inkex.command) succeeded")
-    #         except Exception as e:
-    #             inkex.utils.debug(f"Method 1 failed: {e}")
+            # The captured log is only decoded when it is reported
+            if result.returncode != 0 or not os.path.exists(pdf_file):
+                stdout = result.stdout.decode('utf-8', errors='replace')
+                stderr = result.stderr.decode('utf-8', errors='replace')
+                error_msg = f"LaTeX compilation failed:\nSTDOUT:\n{stdout}\n\nSTDERR:\n{stderr}"
+                raise Exception(error_msg)
             
-    #         # Method 2: Direct subprocess call
-    #         if not svg_created:
-    #             try:
-    #                 result = subprocess.run(
-    #                     ['inkscape', pdf_file, '--export-filename=' + svg_file,
-    #                      '--pdf-poppler', '--export-type=svg', '--export-text-to-path',
-    #                      '--export-area-drawing'],
-    #                     capture_output=True,
-    #                     text=True,
-    #                     timeout=30
-    #                 )
-    #                 if os.path.exists(svg_file):
-    #                     svg_created = True
-    #                     inkex.utils.debug("Method 2 (subprocess) succeeded")
-    #             except Exception as e:
-    #                 inkex.utils.debug(f"Method 2 failed: {e}")
+            # Convert PDF to SVG; method failures are only reported if every
+            # method fails
+            svg_created = False
+            failures = []
             
-    #         # Method 3: Simple conversion
-    #         if not svg_created:
-    #             try:
-    #                 result = subprocess.run(
-    #                     ['inkscape', pdf_file, '--export-filename=' + svg_file],
-    #                     capture_output=True,
-    #                     text=True,
-    #                     timeout=30
-    #                 )
-    #                 if os.path.exists(svg_file):
-    #                     svg_created = True
-    #                     inkex.utils.debug("Method 3 (simple) succeeded")
-    #             except Exception as e:
-    #                 inkex.utils.debug(f"Method 3 failed: {e}")
+            # Method 1: Using inkex.command.inkscape
+            try:
+                inkex.command.inkscape(
+                    pdf_file,
+                    export_filename=svg_file,
+                    pdf_poppler=True,
+                    export_type='svg',
+                    export_text_to_path=True,
+                    export_area_drawing=True
+                )
+                svg_created = os.path.exists(svg_file)
+            except Exception as e:
+                failures.append(f"Method 1 (inkex.command) failed: {e}")
             
-    #         if not svg_created:
-    #             raise Exception(f"PDF to SVG conversion failed. PDF exists at: {pdf_file}")
+            # Method 2: one Inkscape shell process fed an action stream. The
+            # plain export runs first; the text-to-path export then overwrites
+            # it when it succeeds, so both fallbacks share a single process
+            if not svg_created:
+                actions = (
+                    f"file-open:{pdf_file}\n"
+                    f"export-filename:{svg_file}\n"
+                    "export-type:svg\n"
+                    "export-do\n"
+                    "export-text-to-path\n"
+                    "export-area-drawing\n"
+                    "export-do\n"
+                    "file-close\n"
+                    "quit\n"
+                )
+                try:
+                    subprocess.run(
+                        ['inkscape', '--pdf-poppler', '--shell'],
+                        input=actions.encode('utf-8'),
+                        capture_output=True,
+                        timeout=60
+                    )
+                    svg_created = os.path.exists(svg_file)
+                except Exception as e:
+                    failures.append(f"Method 2 (inkscape --shell) failed: {e}")
             
-    #         inkex.utils.debug(f"SVG created: {svg_file}")
+            if not svg_created:
+                details = "\n".join(failures)
+                raise Exception(f"PDF to SVG conversion failed. PDF exists at: {pdf_file}\n{details}".rstrip())
             
-    #         # Copy SVG to avoid temp directory issues
-    #         final_svg = os.path.join(tmpdir, 'bibliography_final.svg')
-    #         shutil.copy2(svg_file, final_svg)
+            # The SVG is read in place by import_latex_svg; the temp directory
+            # is only removed once the extension exits
+            atexit.register(shutil.rmtree, tmpdir, ignore_errors=True)
             
-    #         return final_svg
+            return svg_file
             
-    #     except Exception as e:
-    #         inkex.utils.debug(f"Temp directory preserved at: {tmpdir}")
-    #         raise e
+        except Exception as e:
+            inkex.utils.debug(f"Temp directory preserved at: {tmpdir}")
+            raise e
     
-    # def import_latex_svg(self, svg_file):
-    #     """Import rendered LaTeX SVG into document."""
-    #     try:
-    #         # Parse the SVG file
-    #         tree = etree.parse(svg_file)
-    #         root = tree.getroot()
-            
-    #         # Create a group for the imported content
-    #         group = Group()
-    #         group.set('id', self.svg.get_unique_id('references-latex'))
-            
-    #         # Import all elements from the SVG
-    #         svg_ns = {'svg': 'http://www.w3.org/2000/svg'}
-    #         for element in root:
-    #             tag = etree.QName(element.tag).localname
-    #             if tag not in ['metadata', 'defs']:
-    #                 group.append(element)
-            
-    #         # Import defs if they exist
-    #         defs = root.find('.//svg:defs', svg_ns)
-    #         if defs is not None:
-    #             doc_defs = self.svg.defs
-    #             for def_element in defs:
-    #                 doc_defs.append(def_element)
+    def import_latex_svg(self, svg_file):
+        """Import rendered LaTeX SVG into document."""
+        try:
+            # Create a group for the imported content
+            group = Group()
+            group.set('id', self.svg.get_unique_id('references-latex'))
             
-    #         # Position the group
-    #         x_pos, y_pos = self.get_position()
-    #         transform = Transform()
-    #         transform.add_translate(x_pos, y_pos)
-    #         group.transform = transform
+            # Stream-parse the SVG, moving each top-level element into the
+            # group as soon as it is complete; defs are merged into the
+            # document's defs and metadata is cleared on the spot
+            root = None
+            for event, element in etree.iterparse(svg_file, events=('start', 'end')):
+                if root is None:
+                    root = element
+                    continue
+                if event != 'end' or element.getparent() is not root:
+                    continue
+                tag = element.tag
+                if tag == _DEFS_TAG:
+                    self.svg.defs.extend(element)
+                elif tag == _METADATA_TAG:
+                    element.clear()
+                else:
+                    group.append(element)
             
-    #         # Add to current layer
-    #         self.svg.get_current_layer().append(group)
+            # Position the group
+            x_pos, y_pos = self.get_position()
+            transform = Transform()
+            transform.add_translate(x_pos, y_pos)
+            group.transform = transform
             
-    #         inkex.utils.debug("SVG imported successfully")
+            # Add to current layer
+            self.svg.get_current_layer().append(group)
             
-    #     except Exception as e:
-    #         inkex.errormsg(f"Error importing SVG: {str(e)}")
-    #         raise
+        except Exception as e:
+            inkex.errormsg(f"Error importing SVG: {str(e)}")
+            raise
     
     # Inkscape Backend Methods
     
-    def add_references_to_document(self, formatted_refs):
+    def add_references_to_document(self, formatted_refs, markers):
         """Add formatted references to the Inkscape document at specified position."""
+        opts = self.options
+        font_size = opts.font_size
+        line_spacing = opts.line_spacing
+        hanging = opts.hanging_indent
+        indent_size = opts.indent_size
+        max_width = opts.max_width
+        box_padding = opts.box_padding
+        svg = self.svg
+        
         # Create a group for all references
         group = Group()
-        group.set('id', self.svg.get_unique_id('references'))
+        group.set('id', svg.get_unique_id('references'))
         
-        font_size = self.options.font_size
-        line_height = font_size * self.options.line_spacing
+        line_height = font_size * line_spacing
         font_family = self.get_font_family()
         
         # Calculate approximate character width
         char_width = font_size * 0.6
-        max_chars = int(self.options.max_width / char_width)
+        max_chars = int(max_width / char_width)
         
-        # Calculate marker width for hanging indent
-        sample_marker = self.get_numbering_marker(len(formatted_refs))
-        marker_chars = len(sample_marker) + 1
+        # Marker-prefixed texts for all references, built up front
+        full_texts = [f"{marker} {ref}" if marker else ref for marker, ref in zip(markers, formatted_refs)]
         
-        # Create all text elements
-        all_lines = []
+        # Calculate marker width for hanging indent from the last marker
+        marker_chars = len(markers[-1]) + 1 if markers else 1
         
-        # Title
-        if self.options.show_title:
-            all_lines.append({
-                'text': self.options.title_text,
-                'is_title': True,
-                'indent': 0
-            })
-        
-        # Process each reference
-        for i, ref in enumerate(formatted_refs, 1):
-            marker = self.get_numbering_marker(i)
-            full_text = f"{marker} {ref}" if marker else ref
-            
-            # Calculate indents
-            if self.options.hanging_indent and marker:
-                first_indent = 0
-                subsequent_indent = marker_chars
-            else:
-                first_indent = 0
-                subsequent_indent = 0
-            
-            wrapped_lines = self.wrap_text(full_text, max_chars, first_indent, subsequent_indent)
-            
-            for j, line in enumerate(wrapped_lines):
-                all_lines.append({
-                    'text': line,
-                    'is_title': False,
-                    'is_first': j == 0,
-                    'indent': 0 if j == 0 else (self.options.indent_size if self.options.hanging_indent else 0)
-                })
+        # One wrapper for all references; only its indent changes per call
+        wrapper = TextWrapper(width=max(max_chars, 1), break_long_words=False, break_on_hyphens=False)
         
-        # Calculate total height
-        total_height = len(all_lines) * line_height + self.options.box_padding * 2
+        # Continuation lines of a reference are shifted by the hanging indent
+        continuation_indent = indent_size if hanging else 0
+        
+        title_style = f'font-size:{font_size + 2}px;font-weight:bold;font-family:{font_family};fill:#000000'
+        body_style = f'font-size:{font_size}px;font-family:{font_family};fill:#000000'
         
         # Get position
         x_pos, y_pos = self.get_position()
         
-        # Add background box if requested
-        if self.options.add_box:
-            box = Rectangle()
-            box.set('x', str(x_pos - self.options.box_padding))
-            box.set('y', str(y_pos - self.options.box_padding))
-            box.set('width', str(self.options.max_width + self.options.box_padding * 2))
-            box.set('height', str(total_height))
-            box.style = {
-                'fill': "#ffffff",
-                'fill-opacity': '1',
-                'stroke': '#cccccc',
-                'stroke-width': '1'
-            }
-            group.add(box)
-        
         # Add text elements
         current_y = y_pos + line_height
+        line_count = 0
         
-        for line_data in all_lines:
-            text_elem = TextElement()
-            x_position = x_pos + line_data.get('indent', 0)
-            text_elem.set('x', str(x_position))
-            text_elem.set('y', str(current_y))
-            
-            if line_data['is_title']:
-                text_elem.style = {
-                    'font-size': f'{font_size + 2}px',
-                    'font-weight': 'bold',
-                    'font-family': font_family,
-                    'fill': '#000000'
-                }
-            else:
-                text_elem.style = {
-                    'font-size': f'{font_size}px',
-                    'font-family': font_family,
-                    'fill': '#000000'
-                }
-            
-            text_elem.text = line_data['text']
-            group.add(text_elem)
+        # Title
+        if opts.show_title:
+            etree.SubElement(group, _TEXT_TAG, x=str(x_pos), y=str(current_y),
+                             style=title_style).text = opts.title_text
             
             current_y += line_height
+            line_count += 1
+        
+        # Process each reference; the per-line callables are bound locally
+        sub_element = etree.SubElement
+        wrap_text = self.wrap_text
+        for marker, full_text in zip(markers, full_texts):
+            subsequent_indent = marker_chars if hanging and marker else 0
+            
+            for j, line in enumerate(wrap_text(wrapper, full_text, subsequent_indent)):
+                sub_element(group, _TEXT_TAG, x=str(x_pos + (continuation_indent if j else 0)),
+                            y=str(current_y), style=body_style).text = line
+                
+                current_y += line_height
+                line_count += 1
+        
+        # Add background box if requested, sized from the emitted line count;
+        # it is inserted first so it renders below the text
+        if opts.add_box:
+            box = Rectangle()
+            box.set('x', str(x_pos - box_padding))
+            box.set('y', str(y_pos - box_padding))
+            box.set('width', str(max_width + box_padding * 2))
+            box.set('height', str(line_count * line_height + box_padding * 2))
+            box.set('style', _BOX_STYLE)
+            group.insert(0, box)
         
         # Add the group to the current layer
-        self.svg.get_current_layer().add(group)
-
+        svg.get_current_layer().add(group)
 
 if __name__ == '__main__':
     BibTeXLoader().run()
\ No newline at end of file
@@ -0,0 +1,118 @@
+# cython: language_level=3
+# MIT License
+# Copyright (c) 2026 Rachid, Youven ZEGHLACHE
+"""
+Optional compiled helpers for the BibTeX Loader extension: line wrapping for
+the Inkscape text backend and batch escaping for the LaTeX backend.
+
+Build in place with ``cythonize -i bibtex_wrap.pyx``; bibtex_loader.py falls
+back to textwrap.TextWrapper and its regex escape when this module is not
+importable.
+"""
+
+cimport cython
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def wrap_text(str text, Py_ssize_t width, Py_ssize_t subsequent_indent=0):
+    """Greedily wrap text to width characters, like TextWrapper.wrap.
+
+    Matches TextWrapper with break_long_words and break_on_hyphens disabled:
+    whitespace runs collapse to single spaces and a word longer than the line
+    gets a line of its own. Lines after the first are subsequent_indent
+    characters narrower; the indent itself is not included in the result.
+    """
+    cdef list lines = []
+    cdef list line_words = []
+    cdef Py_ssize_t n = len(text)
+    cdef Py_ssize_t i = 0
+    cdef Py_ssize_t start
+    cdef Py_ssize_t word_len
+    cdef Py_ssize_t line_len = 0
+    cdef Py_ssize_t line_width = width
+    cdef Py_UCS4 ch
+
+    while True:
+        # Skip the whitespace before the next word
+        while i < n:
+            ch = text[i]
+            if not ch.isspace():
+                break
+            i += 1
+        if i >= n:
+            break
+
+        # Find the end of the word
+        start = i
+        while i < n:
+            ch = text[i]
+            if ch.isspace():
+                break
+            i += 1
+        word_len = i - start
+
+        if not line_words:
+            line_words.append(text[start:i])
+            line_len = word_len
+        elif line_len + 1 + word_len <= line_width:
+            line_words.append(text[start:i])
+            line_len += 1 + word_len
+        else:
+            lines.append(' '.join(line_words))
+            line_width = width - subsequent_indent
+            line_words = [text[start:i]]
+            line_len = word_len
+
+    if line_words:
+        lines.append(' '.join(line_words))
+
+    return lines
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def escape_latex_batch(list texts, dict replacements):
+    """Escape every text in one call, returning a list of escaped strings.
+
+    replacements maps single ASCII characters to their escapes. Each text is
+    scanned once, so inserted escapes are never escaped again; texts without
+    special characters are returned as-is.
+    """
+    cdef bint special[128]
+    cdef list escaped = []
+    cdef list parts
+    cdef str text
+    cdef str key
+    cdef Py_ssize_t i
+    cdef Py_ssize_t n
+    cdef Py_ssize_t start
+    cdef Py_UCS4 ch
+
+    for i in range(128):
+        special[i] = False
+    for key in replacements:
+        if len(key) != 1 or ord(key) >= 128:
+            raise ValueError(f"replacement keys must be single ASCII characters: {key!r}")
+        special[ord(key)] = True
+
+    for text in texts:
+        parts = None
+        start = 0
+        n = len(text)
+        for i in range(n):
+            ch = text[i]
+            if ch >= 128 or not special[ch]:
+                continue
+            if parts is None:
+                parts = []
+            parts.append(text[start:i])
+            parts.append(replacements[ch])
+            start = i + 1
+        if parts is None:
+            escaped.append(text)
+        else:
+            parts.append(text[start:])
+            escaped.append(''.join(parts))
+
+    return escaped